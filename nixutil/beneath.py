@@ -1,9 +1,8 @@
-import collections
 import errno
 import os
 import stat
 import sys
-from typing import AnyStr, Callable, Generator, List, Optional, Tuple, Union
+from typing import AnyStr, Callable, List, Optional, Set, Tuple, Union
 
 from . import ffi, plat_util
 
@@ -17,28 +16,63 @@ else:
     # Use O_PATH or O_SEARCH if available, otherwise just O_RDONLY
     DIR_OPEN_FLAGS |= getattr(os, "O_PATH", getattr(os, "O_SEARCH", os.O_RDONLY))
 
+# The file type bits of st_mode (the stat module only exposes this as the S_IFMT() function)
+_S_IFMT = 0o170000
+
+# Added to the flags when opening each individual path component
+_COMPONENT_OPEN_FLAGS = os.O_NOCTTY | os.O_NOFOLLOW
+
+# The errors that opening a symlink with O_NOFOLLOW may fail with.
+# When flags=O_DIRECTORY|O_NOFOLLOW, if the last component is a symlink then it will fail with
+# ENOTDIR. Otherwise, when the last component is a symlink, most OSes return ELOOP. However, FreeBSD
+# returns EMLINK and NetBSD returns EFTYPE.
+_SYMLINK_ERRNOS = (errno.ELOOP, errno.ENOTDIR, errno.EMLINK, getattr(errno, "EFTYPE", None))
+
 _try_open_beneath: Optional[Callable[..., int]] = getattr(plat_util, "try_open_beneath", None)
 
 
 def _split_path(
-    path: AnyStr, *, slash: AnyStr, flags: int, orig_path: AnyStr
-) -> Generator[Tuple[AnyStr, int], None, None]:
+    path: AnyStr, *, slash: AnyStr, dot: AnyStr, flags: int, orig_path: AnyStr
+) -> List[Tuple[AnyStr, int]]:
     if not path:
         raise ffi.build_oserror(errno.ENOENT, orig_path)
 
     if path.endswith(slash):
         flags |= os.O_DIRECTORY
 
-    split_parts = list(filter(bool, path.split(slash)))
+    split_parts = [part for part in path.split(slash) if part]
+
+    parts = []
 
     if path.startswith(slash):
-        yield slash, (DIR_OPEN_FLAGS if split_parts else flags)
+        parts.append((slash, DIR_OPEN_FLAGS if split_parts else flags))
 
     for part in split_parts[:-1]:
-        yield part, DIR_OPEN_FLAGS
+        # "." components are no-ops unless they're the last component (in which case they must be
+        # opened with the specified flags), so we can drop them here.
+        if part != dot:
+            parts.append((part, DIR_OPEN_FLAGS))
 
     if split_parts:
-        yield split_parts[-1], flags
+        parts.append((split_parts[-1], flags))
+
+    return parts
+
+
+def _is_unwanted_symlink(fd: int, flags: int) -> bool:
+    # On Linux, O_PATH|O_NOFOLLOW will return a file descriptor open to the *symlink* (though adding
+    # in O_DIRECTORY will prevent this by only allowing a directory). Since we "add in" O_NOFOLLOW,
+    # if O_PATH was specified and neither O_NOFOLLOW nor O_DIRECTORY was, we might accidentally open
+    # a symlink when that isn't what the user wants.
+    #
+    # So let's check if it's a symlink in that case.
+
+    return (
+        sys.platform.startswith("linux")
+        and flags & (os.O_PATH | os.O_NOFOLLOW | os.O_DIRECTORY)  # pylint: disable=no-member
+        == os.O_PATH  # pylint: disable=no-member
+        and os.fstat(fd).st_mode & _S_IFMT == stat.S_IFLNK
+    )
 
 
 def open_beneath(
@@ -130,12 +164,15 @@ def open_beneath(
 
     slash: AnyStr
     dot: AnyStr
+    dotdot: AnyStr
     if isinstance(path, bytes):
         slash = b"/"
         dot = b"."
+        dotdot = b".."
     else:
         slash = "/"
         dot = "."
+        dotdot = ".."
 
     # We need a file descriptor that won't move (the current directory might) that we can use to
     # perform lookups from.
@@ -150,6 +187,7 @@ def open_beneath(
             no_symlinks,
             slash=slash,
             dot=dot,
+            dotdot=dotdot,
             remember_parents=remember_parents,
             audit_func=audit_func,
         )
@@ -158,33 +196,35 @@ def open_beneath(
             os.close(new_dir_fd)  # pytype: disable=bad-return-type
 
 
-def _check_beneath(cur_fd: int, dir_fd_stat: os.stat_result, orig_path: AnyStr) -> None:
+def _check_beneath(cur_fd: int, dir_fd_key: Tuple[int, int], orig_path: AnyStr) -> None:
     # We need to rewind up the directory tree and make sure that we didn't escape because of
     # race conditions with "..".
 
     orig_fd = cur_fd
-    prev_stat = None
+    seen_keys: Set[Tuple[int, int]] = set()
 
     try:
         while True:
             cur_stat = os.fstat(cur_fd)
+            cur_key = (cur_stat.st_dev, cur_stat.st_ino)
 
-            if os.path.samestat(cur_stat, dir_fd_stat):
+            if cur_key == dir_fd_key:
                 # We found it! We *didn't* escape.
                 return
-            elif prev_stat is not None and os.path.samestat(cur_stat, prev_stat):
-                # Trying to open ".." brought us the same directory. That means we're at "/"
-                # (the REAL "/").
-                # So we escaped the "beneath" directory.
+            elif cur_key in seen_keys:
+                # Trying to open ".." brought us back to a directory we've already seen. Normally
+                # that means we're at "/" (the REAL "/"); otherwise the tree is being rearranged
+                # underneath us and we might never find the "beneath" directory.
+                # Either way, assume we escaped the "beneath" directory.
                 raise ffi.build_oserror(errno.EXDEV, orig_path)
 
+            seen_keys.add(cur_key)
+
             new_fd = os.open("..", DIR_OPEN_FLAGS, dir_fd=cur_fd)
             if cur_fd != orig_fd:
                 os.close(cur_fd)
             cur_fd = new_fd
 
-            prev_stat = cur_stat
-
     finally:
         if cur_fd != orig_fd:
             os.close(cur_fd)
@@ -199,19 +239,35 @@ def _open_beneath(
     *,
     slash: AnyStr,
     dot: AnyStr,
+    dotdot: AnyStr,
     remember_parents: bool,
     audit_func: Optional[Callable[[str, int, AnyStr], None]] = None,
 ) -> int:
     dir_fd_stat = os.fstat(dir_fd)
 
-    if not stat.S_ISDIR(dir_fd_stat.st_mode):
+    if dir_fd_stat.st_mode & _S_IFMT != stat.S_IFDIR:
         raise ffi.build_oserror(errno.ENOTDIR, orig_path)
 
-    parts = collections.deque(
-        _split_path(orig_path, slash=slash, flags=orig_flags, orig_path=orig_path)
-    )
+    if audit_func is None and orig_path not in (dot, dotdot) and slash not in orig_path:
+        # Fast path: a single component (like "file.txt") can be opened directly. We only need the
+        # full resolution logic below if it turns out to be a symlink.
+        try:
+            fd = os.open(orig_path, orig_flags | _COMPONENT_OPEN_FLAGS, mode=mode, dir_fd=dir_fd)
+        except OSError as ex:
+            if ex.errno not in _SYMLINK_ERRNOS:
+                raise
+        else:
+            if not _is_unwanted_symlink(fd, orig_flags):
+                return fd
+
+            os.close(fd)
+
+    # Compared against directly instead of calling os.path.samestat() every time
+    dir_fd_key = (dir_fd_stat.st_dev, dir_fd_stat.st_ino)
 
-    dotdot = dot + dot
+    # This is used as a stack, so the components are stored in reverse order
+    parts = _split_path(orig_path, slash=slash, dot=dot, flags=orig_flags, orig_path=orig_path)
+    parts.reverse()
 
     if no_symlinks and dotdot not in parts:
         # We will *never* see ".."
@@ -231,13 +287,17 @@ def _open_beneath(
     # So we keep going, and we may in fact open "/etc/passwd" without realizing it!
     #
     # So when we see a ".." element with remember_parents=False, we resolve it, then we set
-    # saw_parent_elem=True. The next time around, if we don't see ".." or "/", we checl to make sure
+    # saw_parent_elem=True. The next time around, if we don't see ".." or "/", we check to make sure
     # that we haven't escaped before resolving that component.
+    #
+    # This means that a run of consecutive ".." elements only triggers one check. However, the check
+    # can't be skipped even if we've descended more times than we've ascended (e.g. "a/../b"); the
+    # scenario above only requires a single ".." to escape.
     saw_parent_elem = False
 
     try:
         while parts:
-            part, flags = parts.popleft()
+            part, flags = parts.pop()
 
             # Sanity check -- `flags` can only ever be something other than DIR_OPEN_FLAGS if there
             # are no components left
@@ -247,6 +307,9 @@ def _open_beneath(
                 audit_func("before", cur_fd, part)
 
             old_fd = cur_fd
+            # Whether we own `old_fd` and should close it once we've moved past it. We never own
+            # `dir_fd`, and ownership is passed on if `old_fd` is moved onto `parent_fds`.
+            owns_old_fd = old_fd != dir_fd
 
             try:
                 if part == slash:
@@ -271,9 +334,13 @@ def _open_beneath(
                             cur_fd = dir_fd
 
                     else:
-                        if cur_fd == dir_fd or os.path.samestat(os.fstat(cur_fd), dir_fd_stat):
+                        if cur_fd != dir_fd:
+                            cur_stat = os.fstat(cur_fd)
+                            if (cur_stat.st_dev, cur_stat.st_ino) == dir_fd_key:
+                                cur_fd = dir_fd
+
+                        if cur_fd == dir_fd:
                             # We hit the root; stay there
-                            cur_fd = dir_fd
                             saw_parent_elem = False
                         else:
                             cur_fd = os.open("..", flags, dir_fd=cur_fd)
@@ -289,49 +356,21 @@ def _open_beneath(
                         # This will avoid problems with potential information leakage based on the
                         # error message (i.e. does a given file exist).
                         assert not remember_parents
-                        _check_beneath(cur_fd, dir_fd_stat, orig_path)
+                        _check_beneath(cur_fd, dir_fd_key, orig_path)
                         saw_parent_elem = False
 
                     try:
                         cur_fd = os.open(
-                            part, flags | os.O_NOCTTY | os.O_NOFOLLOW, mode=mode, dir_fd=cur_fd
+                            part, flags | _COMPONENT_OPEN_FLAGS, mode=mode, dir_fd=cur_fd
                         )
 
-                        # On Linux, O_PATH|O_NOFOLLOW will return a file descriptor open to the
-                        # *symlink* (though adding in O_DIRECTORY will prevent this by only allowing
-                        # a directory). Since we "add in" O_NOFOLLOW, if O_PATH was specified and
-                        # neither O_NOFOLLOW nor O_DIRECTORY was, we might accidentally open a
-                        # symlink when that isn't what the user wants.
-                        #
-                        # So let's check if it's a symlink in that case.
-
-                        if (
-                            sys.platform.startswith("linux")
-                            and flags
-                            & (
-                                os.O_PATH  # pylint: disable=no-member
-                                | os.O_NOFOLLOW
-                                | os.O_DIRECTORY
-                            )
-                            == os.O_PATH  # pylint: disable=no-member
-                            and stat.S_ISLNK(os.stat(cur_fd).st_mode)
-                        ):
+                        if _is_unwanted_symlink(cur_fd, flags):
                             os.close(cur_fd)
                             cur_fd = old_fd
                             raise ffi.build_oserror(errno.ELOOP, orig_path)
 
                     except OSError as ex:
-                        # When flags=O_DIRECTORY|O_NOFLLOW, if the last component is a symlink then
-                        # it will fail with ENOTDIR.
-                        # Otherwise, when the last component is a symlink, most OSes return ELOOP.
-                        # However, FreeBSD returns EMLINK and NetBSD returns EFTYPE.
-
-                        if ex.errno not in (
-                            errno.ELOOP,
-                            errno.ENOTDIR,
-                            errno.EMLINK,
-                            getattr(errno, "EFTYPE", None),
-                        ):
+                        if ex.errno not in _SYMLINK_ERRNOS:
                             raise
 
                         # It may have failed because it's a symlink.
@@ -354,22 +393,18 @@ def _open_beneath(
                                 raise
 
                         if audit_func is not None:
-                            audit_func(
-                                "symlink",
-                                cur_fd,
-                                (os.fsencode(target) if isinstance(orig_path, bytes) else target),
-                            )
+                            # os.readlink() returns the same type as `part`, so `target` is already
+                            # a str or bytes to match `orig_path`.
+                            audit_func("symlink", cur_fd, target)
 
                         found_symlinks += 1
                         if flags & os.O_NOFOLLOW or found_symlinks > max_symlinks:
                             raise ffi.build_oserror(errno.ELOOP, orig_path) from ex
 
-                        parts.extendleft(
+                        parts.extend(
                             reversed(
-                                list(
-                                    _split_path(
-                                        target, slash=slash, flags=flags, orig_path=orig_path
-                                    )
+                                _split_path(
+                                    target, slash=slash, dot=dot, flags=flags, orig_path=orig_path
                                 )
                             )
                         )
@@ -377,18 +412,19 @@ def _open_beneath(
                     else:
                         # Successfully opened
 
-                        if remember_parents and old_fd != dir_fd:
+                        if remember_parents and owns_old_fd:
                             parent_fds.append(old_fd)
+                            owns_old_fd = False
 
             finally:
-                if old_fd not in (cur_fd, dir_fd) and old_fd not in parent_fds:
+                if owns_old_fd and old_fd != cur_fd:
                     os.close(old_fd)
 
         if saw_parent_elem:
             assert not remember_parents
             assert not parent_fds
             assert cur_fd != dir_fd
-            _check_beneath(cur_fd, dir_fd_stat, orig_path)
+            _check_beneath(cur_fd, dir_fd_key, orig_path)
 
     except BaseException:  # pylint: disable=broad-except
         if cur_fd != dir_fd:
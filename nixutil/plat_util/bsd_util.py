@@ -1,6 +1,7 @@
 import ctypes
 import errno
-from typing import Collection, Optional, Union
+import functools
+from typing import Collection, Optional, Tuple, Union
 
 from .. import ffi
 
@@ -17,19 +18,26 @@ libc.sysctl.argtypes = (
 libc.sysctl.restype = ctypes.c_int
 
 
+@functools.lru_cache(maxsize=128)
+def _build_raw_mib(mib: Tuple[int, ...]) -> "ctypes.Array[ctypes.c_int]":
+    # sysctl() never modifies the MIB, so it's safe to share these arrays between calls
+    return (ctypes.c_int * len(mib))(*mib)  # pytype: disable=not-callable
+
+
 def sysctl(
     mib: Collection[int],
     new: Union[None, bytes, ctypes.Array, ctypes.Structure],  # type: ignore
     old: Union[None, ctypes.Array, ctypes.Structure],  # type: ignore
 ) -> int:
-    raw_mib = (ctypes.c_int * len(mib))(*mib)  # pytype: disable=not-callable
+    raw_mib = _build_raw_mib(tuple(mib))
 
     if new is None:
         new_size = 0
         raw_new = None
     elif isinstance(new, bytes):
         new_size = len(new)
-        raw_new = ctypes.byref(ctypes.create_string_buffer(new))
+        # Unlike create_string_buffer(), this doesn't add a trailing NUL that sysctl() won't read
+        raw_new = ctypes.byref((ctypes.c_char * new_size).from_buffer_copy(new))
     else:
         new_size = ctypes.sizeof(new)
         raw_new = ctypes.byref(new)
@@ -47,16 +55,23 @@ def sysctl(
     return old_size.value
 
 
-def sysctl_bytes_retry(mib: Collection[int], new: Optional[bytes], trim_nul: bool = False) -> bytes:
-    while True:
-        old_len = sysctl(mib, None, None)
+def sysctl_bytes_retry(
+    mib: Collection[int], new: Optional[bytes], trim_nul: bool = False, initial_size: int = 4096
+) -> bytes:
+    # Try with a buffer that's large enough for most values first, and only ask the kernel how much
+    # space is needed if that isn't enough. This saves a sysctl() call in the common case.
+    buf_size = initial_size
 
-        buf = (ctypes.c_char * old_len)()  # pytype: disable=not-callable
+    while True:
+        buf = (ctypes.c_char * buf_size)()  # pytype: disable=not-callable
 
         try:
             old_len = sysctl(mib, new, buf)
         except OSError as ex:
             if ex.errno != errno.ENOMEM:
                 raise
+
+            # Grow at least geometrically, in case the value keeps growing between calls
+            buf_size = max(buf_size * 2, sysctl(mib, None, None))
         else:
             return (buf.value if trim_nul else buf.raw)[:old_len]
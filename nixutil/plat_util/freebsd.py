@@ -1,16 +1,24 @@
 # pylint: disable=invalid-name,too-few-public-methods
 import ctypes
+import errno
 import os
-from typing import Iterator, Optional
+import struct
+from typing import Iterator, Optional, Tuple
 
+from .. import ffi
 from . import bsd_util
 
+libc = ffi.load_libc()
+
 CTL_KERN = 1
 KERN_PROC = 14
 KERN_PROC_FILEDESC = 33
 
 KF_TYPE_VNODE = 1
 
+# FreeBSD 13.1+
+F_KINFO = 22
+
 PATH_MAX = 1024
 
 pid_t = ctypes.c_int
@@ -162,30 +170,106 @@ class KinfoFile(ctypes.Structure):
     ]
 
 
-def _iter_kinfo_files(pid: int) -> Iterator[KinfoFile]:
+# The KinfoFile definition is only used to determine the layout; at runtime, we read the fields we
+# need directly out of the buffer.
+
+# kf_structsize, kf_type, and kf_fd are the first 3 fields
+_KF_HEADER = struct.Struct("iii")
+
+_KF_PATH_OFFSET = KinfoFile.kf_path.offset  # pylint: disable=no-member
+
+# Size of the buffer to pass for the first KERN_PROC_FILEDESC call. Each entry is ~1.4K, so this
+# starts out large enough for a few dozen open files, and it's raised if the file table outgrows it.
+_filedesc_buf_size = 65536
+
+
+def _iter_kinfo_files(pid: int, match_fd: Optional[int] = None) -> Iterator[Tuple[int, int, bytes]]:
+    # Yields (kf_type, kf_fd, kf_path) for each file (or only for the file descriptor `match_fd`, if
+    # it's specified). Only these fields are read out of the buffer, instead of copying each entry
+    # into a full KinfoFile structure.
+
+    global _filedesc_buf_size  # pylint: disable=global-statement
+
     kinfo_file_data = bsd_util.sysctl_bytes_retry(
-        [CTL_KERN, KERN_PROC, KERN_PROC_FILEDESC, pid], None
+        [CTL_KERN, KERN_PROC, KERN_PROC_FILEDESC, pid], None, initial_size=_filedesc_buf_size
     )
 
-    kinfo_file_size = ctypes.sizeof(KinfoFile)
+    if len(kinfo_file_data) > _filedesc_buf_size // 2:
+        # Leave some room for the file table to grow so the next call doesn't hit ENOMEM
+        _filedesc_buf_size = len(kinfo_file_data) * 2
 
     i = 0
-    while i < len(kinfo_file_data):
-        kfile_data = kinfo_file_data[i: i + kinfo_file_size].ljust(kinfo_file_size, b"\0")
-        kfile = KinfoFile.from_buffer_copy(kfile_data)
+    while len(kinfo_file_data) - i >= _KF_HEADER.size:
+        kf_structsize, kf_type, kf_fd = _KF_HEADER.unpack_from(kinfo_file_data, i)
 
-        if kfile.kf_structsize == 0:
+        if kf_structsize == 0:
             break
 
-        yield kfile
+        if match_fd is not None and kf_fd != match_fd:
+            # Skip it without extracting the path
+            i += kf_structsize
+            continue
+
+        # The entries are packed, so the path may be truncated to the end of this entry
+        path_start = i + _KF_PATH_OFFSET
+        path_end = min(i + kf_structsize, path_start + PATH_MAX)
+
+        yield kf_type, kf_fd, kinfo_file_data[path_start:path_end].split(b"\0", 1)[0]
+
+        i += kf_structsize
+
 
-        i += kfile.kf_structsize
+# Set once F_KINFO has failed with EINVAL, which means the kernel doesn't support it
+_f_kinfo_broken = False
+
+_KINFO_FILE_SIZE = ctypes.sizeof(KinfoFile)
+
+
+def _get_kinfo_file(fd: int) -> Optional[Tuple[int, bytes]]:
+    # Returns (kf_type, kf_path) for the given file descriptor. Returns None if F_KINFO isn't
+    # supported, and raises OSError for other errors (like EBADF).
+    # (fcntl.fcntl() can't be used for this because it limits the buffer to 1024 bytes.)
+
+    global _f_kinfo_broken  # pylint: disable=global-statement
+
+    buf = (ctypes.c_char * _KINFO_FILE_SIZE)()  # pytype: disable=not-callable
+    # The kernel checks kf_structsize to make sure we agree on the structure's size
+    struct.pack_into("i", buf, 0, _KINFO_FILE_SIZE)
+
+    if libc.fcntl(fd, F_KINFO, buf) < 0:
+        eno = ctypes.get_errno()
+        if eno == errno.EINVAL:
+            _f_kinfo_broken = True
+            return None
+
+        raise ffi.build_oserror(eno)
+
+    _, kf_type, _ = _KF_HEADER.unpack_from(buf)
+
+    return kf_type, buf.raw[_KF_PATH_OFFSET:].split(b"\0", 1)[0]
+
+
+def _get_vnode_path(kf_type: int, kf_path: bytes) -> Optional[str]:
+    if kf_type == KF_TYPE_VNODE:
+        # Sometimes the path is empty ("") for no apparent reason.
+        return os.fsdecode(kf_path) or None
+
+    return None
 
 
 def try_recover_fd_path(fd: int) -> Optional[str]:
-    for kfile in _iter_kinfo_files(os.getpid()):
-        if kfile.kf_fd == fd and kfile.kf_type == KF_TYPE_VNODE:
-            # Sometimes the path is empty ("") for no apparent reason.
-            return os.fsdecode(kfile.kf_path) or None
+    if not _f_kinfo_broken:
+        # This only returns the entry for `fd`, so it's much faster than scanning the whole file
+        # table
+        try:
+            info = _get_kinfo_file(fd)
+        except OSError:
+            return None
+
+        if info is not None:
+            return _get_vnode_path(*info)
+
+    for kf_type, _, kf_path in _iter_kinfo_files(os.getpid(), match_fd=fd):
+        return _get_vnode_path(kf_type, kf_path)
 
     return None
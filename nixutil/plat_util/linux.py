@@ -1,8 +1,9 @@
 import ctypes
 import ctypes.util
 import errno
+import functools
 import os
-from typing import AnyStr, Optional
+from typing import Any, AnyStr, Optional
 
 from .. import ffi
 
@@ -16,11 +17,14 @@ SYS_OPENAT2 = None
 machine = os.uname().machine
 if machine == "alpha":
     SYS_OPENAT2 = 547
-elif machine in ("x86_64", "i386", "i486", "i586", "i686", "sh") or any(
-    machine.startswith(s) for s in ("s390", "riscv", "ppc", "parisc", "mips", "arm", "aarch64")
+elif machine in ("x86_64", "i386", "i486", "i586", "i686", "sh") or machine.startswith(
+    ("s390", "riscv", "ppc", "parisc", "mips", "arm", "aarch64")
 ):
     SYS_OPENAT2 = 437
 
+# Set once openat2() has failed in a way that means it will never work in this process
+_openat2_broken = False
+
 AT_FDCWD = -100
 
 RESOLVE_NO_MAGICLINKS = 0x02
@@ -36,6 +40,18 @@ class _OpenHow(ctypes.Structure):  # pylint: disable=too-few-public-methods
     ]
 
 
+_OPEN_HOW_SIZE = ctypes.sizeof(_OpenHow)
+
+
+@functools.lru_cache(maxsize=64)
+def _get_open_how_ref(flags: int, mode: int, resolve: int) -> Any:
+    # Callers tend to use the same few combinations over and over, so reuse the structures (and
+    # references to them) instead of building new ones for every call. They're never modified after
+    # creation, so sharing them between threads (or with a signal handler that interrupts a call) is
+    # safe.
+    return ctypes.byref(_OpenHow(flags=flags, mode=mode, resolve=resolve))
+
+
 def try_open_beneath(
     path: AnyStr,
     flags: int,
@@ -44,10 +60,17 @@ def try_open_beneath(
     dir_fd: Optional[int],
     no_symlinks: bool,
 ) -> Optional[int]:
-    if SYS_OPENAT2 is None:
+    global _openat2_broken  # pylint: disable=global-statement
+
+    if SYS_OPENAT2 is None or _openat2_broken:
         return None
 
-    c_path = ctypes.create_string_buffer(os.fsencode(path))
+    # bytes objects are always NUL-terminated internally, so ctypes can pass a pointer to the
+    # existing buffer instead of copying it into a new one
+    c_path = os.fsencode(path)
+    if b"\0" in c_path:
+        # Match os.open()
+        raise ValueError("embedded null byte")
 
     resolve_flags = RESOLVE_NO_MAGICLINKS | RESOLVE_IN_ROOT
     if no_symlinks:
@@ -62,15 +85,15 @@ def try_open_beneath(
             os.O_PATH | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC  # pylint: disable=no-member
         )
 
-    how = _OpenHow(
-        flags=flags,
-        mode=(
+    how_ref = _get_open_how_ref(
+        flags,
+        (
             mode
             if flags & os.O_CREAT == os.O_CREAT  # pylint: disable=no-member
             or flags & os.O_TMPFILE == os.O_TMPFILE  # pylint: disable=no-member
             else 0
         ),
-        resolve=resolve_flags,
+        resolve_flags,
     )
 
     if dir_fd is None:
@@ -81,22 +104,28 @@ def try_open_beneath(
         )
 
     while True:
-        fd: int = libc.syscall(SYS_OPENAT2, dir_fd, c_path, ctypes.byref(how), ctypes.sizeof(how))
+        fd: int = libc.syscall(SYS_OPENAT2, dir_fd, c_path, how_ref, _OPEN_HOW_SIZE)
 
         if fd >= 0:
             return fd
 
         eno = ctypes.get_errno()
-        if eno in (errno.E2BIG, errno.ENOSYS, errno.EPERM):
+        if eno in (errno.E2BIG, errno.ENOSYS):
+            # The kernel doesn't support openat2() (or our version of struct open_how); that isn't
+            # going to change, so don't bother trying again
+            _openat2_broken = True
+            return None
+        elif eno == errno.EPERM:
             return None
         elif eno != errno.EINTR:
-            raise ffi.build_oserror(eno, os.fsdecode(path))
+            raise ffi.build_oserror(eno, path)
 
 
 def try_recover_fd_path(fd: int) -> Optional[str]:
+    # Work with bytes until the end to avoid encoding/decoding the path more than necessary
     try:
-        path = os.readlink("/proc/self/fd/{}".format(fd))
+        path = os.readlink(b"/proc/self/fd/%d" % fd)
     except OSError:
         return None
 
-    return path if path.startswith("/") and not path.endswith(" (deleted)") else None
+    return os.fsdecode(path) if path.startswith(b"/") and not path.endswith(b" (deleted)") else None
@@ -6,11 +6,15 @@ PATH_MAX = 1024
 
 F_GETPATH = getattr(fcntl, "F_GETPATH", 50)
 
+# fcntl() copies this into its own buffer, so it can be shared between calls
+_PATH_BUF = b"\0" * PATH_MAX
+
 
 def try_recover_fd_path(fd: int) -> Optional[str]:
     try:
-        res = fcntl.fcntl(fd, F_GETPATH, b"\0" * PATH_MAX)
+        res = fcntl.fcntl(fd, F_GETPATH, _PATH_BUF)
     except OSError:
         return None
 
-    return os.fsdecode(res[: res.index(0)]) or None
+    end = res.find(b"\0")
+    return os.fsdecode(res[:end] if end != -1 else res) or None
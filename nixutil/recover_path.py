@@ -1,10 +1,14 @@
 import errno
 import os
 import stat
-import sys
+from typing import Callable, Optional
 
 from . import ffi, plat_util
 
+_try_recover_fd_path: Optional[Callable[[int], Optional[str]]] = getattr(
+    plat_util, "try_recover_fd_path", None
+)
+
 
 def recover_fd_path(fd: int) -> str:
     """
@@ -28,8 +32,8 @@ def recover_fd_path(fd: int) -> str:
     if fd < 0:
         raise ffi.build_oserror(errno.EBADF)
 
-    if hasattr(plat_util, "try_recover_fd_path"):
-        path = plat_util.try_recover_fd_path(fd)
+    if _try_recover_fd_path is not None:
+        path = _try_recover_fd_path(fd)
         if path is not None:
             return path
 
@@ -47,7 +51,8 @@ def recover_fd_path(fd: int) -> str:
 
     while True:
         try:
-            parent_fd = os.open("..", os.O_RDONLY, dir_fd=sub_fd)
+            # This can't be O_PATH/O_SEARCH; we need to be able to list the directory
+            parent_fd = os.open("..", os.O_RDONLY | os.O_DIRECTORY, dir_fd=sub_fd)
         finally:
             if sub_fd != orig_fd:
                 os.close(sub_fd)
@@ -82,42 +87,38 @@ def recover_fd_path(fd: int) -> str:
         sub_stat = parent_stat
 
 
-if sys.version_info >= (3, 7):
-
-    def _recover_fname(parent_fd: int, sub_stat: os.stat_result) -> str:
-        with os.scandir(parent_fd) as parent_dir_it:
-            for entry in parent_dir_it:
-                try:
-                    # We can't check entry.inode() for speedups because that doesn't work properly
-                    # if the file that was pointed to by `sub_fd` is a mountpoint.
+def _recover_fname(parent_fd: int, sub_stat: os.stat_result) -> str:
+    # Directories whose inode numbers didn't match
+    other_dir_entries = []
 
-                    if entry.is_dir(follow_symlinks=False) and os.path.samestat(
-                        sub_stat, entry.stat(follow_symlinks=False)
-                    ):
+    with os.scandir(parent_fd) as parent_dir_it:
+        for entry in parent_dir_it:
+            try:
+                # entry.inode() is usually free (it comes from the directory entry), so use it
+                # to find the most likely candidate without stat()ing every entry.
+                if entry.inode() == sub_stat.st_ino:
+                    if os.path.samestat(sub_stat, entry.stat(follow_symlinks=False)):
                         return entry.name  # pytype: disable=bad-return-type
 
-                except OSError:
-                    # Yes, errors could occur when trying to stat() it. For example, trying to
-                    # stat() the root directory of a FUSE filesystem that died without being
-                    # properly unmounted will fail with ENOTCONN.
-                    pass
-
-        # Unable to find a matching entry; probably means the directory was deleted
-        raise ffi.build_oserror(errno.ENOENT)
+                elif entry.is_dir(follow_symlinks=False):
+                    other_dir_entries.append(entry)
 
+            except OSError:
+                # Yes, errors could occur when trying to stat() it. For example, trying to
+                # stat() the root directory of a FUSE filesystem that died without being
+                # properly unmounted will fail with ENOTCONN.
+                pass
 
-else:
-
-    def _recover_fname(parent_fd: int, sub_stat: os.stat_result) -> str:
-        for fname in os.listdir(parent_fd):
+        # However, entry.inode() doesn't work properly if the file that was pointed to by
+        # `sub_fd` is a mountpoint (it gives the inode number of the directory underneath the
+        # mountpoint). So if that didn't find anything, we have to check the other directories.
+        for entry in other_dir_entries:
             try:
-                if os.path.samestat(
-                    sub_stat, os.stat(fname, dir_fd=parent_fd, follow_symlinks=False)
-                ):
-                    return fname
+                if os.path.samestat(sub_stat, entry.stat(follow_symlinks=False)):
+                    return entry.name  # pytype: disable=bad-return-type
 
             except OSError:
                 pass
 
-        # Unable to find a matching entry; probably means the directory was deleted
-        raise ffi.build_oserror(errno.ENOENT)
+    # Unable to find a matching entry; probably means the directory was deleted
+    raise ffi.build_oserror(errno.ENOENT)
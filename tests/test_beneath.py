@@ -1,4 +1,4 @@
-import contextlib
+# pylint: disable=redefined-outer-name,too-many-arguments
 import errno
 import fcntl
 import itertools
@@ -6,7 +6,7 @@ import os
 import pathlib
 import re
 import sys
-from typing import Any, Dict, Generator, cast
+from typing import Any, Callable, Dict, Generator, Optional, Tuple, cast
 
 import pytest
 
@@ -15,14 +15,20 @@ import nixutil
 from .util import managed_open
 
 
-@contextlib.contextmanager
-def open_beneath_managed(*args: Any, **kwargs: Any) -> Generator[int, None, None]:
-    fd = nixutil.open_beneath(*args, **kwargs)
+class open_beneath_managed:  # pylint: disable=invalid-name
+    __slots__ = ("_args", "_kwargs", "_fd")
 
-    try:
-        yield fd
-    finally:
-        os.close(fd)
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._args = args
+        self._kwargs = kwargs
+        self._fd = -1
+
+    def __enter__(self) -> int:
+        self._fd = nixutil.open_beneath(*self._args, **self._kwargs)
+        return self._fd
+
+    def __exit__(self, *exc: Any) -> None:
+        os.close(self._fd)
 
 
 def test_open_beneath_basic() -> None:
@@ -51,41 +57,42 @@ def test_open_beneath_basic() -> None:
     with pytest.raises(FileNotFoundError):
         nixutil.open_beneath("", os.O_RDONLY, audit_func=lambda desc, fd, name: None)
 
-    with open(sys.executable) as file:
+    # Like os.open(), the filename in errors is the same type as the path that was passed
+    for path in cast(Any, ["NOEXIST", b"NOEXIST"]):
+        for audit_func in [None, lambda desc, fd, name: None]:
+            with pytest.raises(FileNotFoundError) as exc_info:
+                nixutil.open_beneath(path, os.O_RDONLY, audit_func=audit_func)
+
+            assert exc_info.value.filename == path
+
+    # Like os.open(), embedded NULs are rejected
+    with pytest.raises(ValueError):
+        nixutil.open_beneath("a\0b", os.O_RDONLY)
+
+    with pytest.raises(ValueError):
+        nixutil.open_beneath("a\0b", os.O_RDONLY, audit_func=lambda desc, fd, name: None)
+
+    with managed_open(sys.executable, os.O_RDONLY) as file_fd:
         with pytest.raises(NotADirectoryError):
-            nixutil.open_beneath("a", os.O_RDONLY, dir_fd=file.fileno())
+            nixutil.open_beneath("a", os.O_RDONLY, dir_fd=file_fd)
 
         with pytest.raises(NotADirectoryError):
             nixutil.open_beneath(
-                "a", os.O_RDONLY, dir_fd=file.fileno(), audit_func=lambda desc, fd, name: None
+                "a", os.O_RDONLY, dir_fd=file_fd, audit_func=lambda desc, fd, name: None
             )
 
 
-def test_open_beneath_root(tmp_path: pathlib.Path) -> None:
-    with managed_open("/", os.O_RDONLY) as root_dfd:
-        for remember_parents, audit_func in itertools.product(
-            [False, True], [None, lambda desc, fd, name: None]
-        ):
-            with open_beneath_managed(
-                tmp_path,
-                os.O_RDONLY,
-                dir_fd=root_dfd,
-                remember_parents=remember_parents,
-                audit_func=audit_func,
-            ) as fd:
-                assert os.path.samestat(os.fstat(fd), os.stat(tmp_path))
+# (path, dir_fd, expect_keys)
+_BeneathTree = Tuple[pathlib.Path, int, Dict[Optional[str], Tuple[int, int]]]
 
-            with open_beneath_managed(
-                str(tmp_path) + "/.." * (str(tmp_path).count("/") + 2),
-                os.O_RDONLY,
-                dir_fd=root_dfd,
-                remember_parents=remember_parents,
-                audit_func=audit_func,
-            ) as fd:
-                assert os.path.sameopenfile(fd, root_dfd)
 
+# None of the tests that use this modify the tree, so it's only built once for the whole module
+@pytest.fixture(scope="module")
+def beneath_tree(
+    tmp_path_factory: pytest.TempPathFactory,
+) -> Generator[_BeneathTree, None, None]:
+    tmp_path = tmp_path_factory.mktemp("beneath")
 
-def test_open_beneath(tmp_path: pathlib.Path) -> None:
     os.mkdir(tmp_path / "a")
 
     with open(tmp_path / "b", "w"):
@@ -108,128 +115,270 @@ def test_open_beneath(tmp_path: pathlib.Path) -> None:
     os.symlink("recur", tmp_path / "recur")
 
     with managed_open(tmp_path, os.O_RDONLY) as tmp_dfd:
-        tmp_stat = os.stat(tmp_dfd)
+        # The (st_ino, st_dev) of the files that the stat_fname values in _OPEN_BENEATH_PATHS refer
+        # to (None means the directory itself). The tree never changes, so these only need to be
+        # looked up once.
+        tmp_stat = os.fstat(tmp_dfd)
+        expect_keys: Dict[Optional[str], Tuple[int, int]] = {
+            None: (tmp_stat.st_ino, tmp_stat.st_dev)
+        }
+        for name in ["a", "a/e", "b", "f"]:
+            st = os.stat(name, dir_fd=tmp_dfd, follow_symlinks=False)
+            expect_keys[name] = (st.st_ino, st.st_dev)
+
+        yield tmp_path, tmp_dfd, expect_keys
+
+
+def test_open_beneath_root(beneath_tree: _BeneathTree) -> None:
+    tmp_path, _, expect_keys = beneath_tree
+
+    with managed_open("/", os.O_RDONLY) as root_dfd:
+        root_stat = os.fstat(root_dfd)
+        root_key = (root_stat.st_ino, root_stat.st_dev)
 
         for remember_parents, audit_func in itertools.product(
             [False, True], [None, lambda desc, fd, name: None]
         ):
-            try_paths = [
-                ("/", os.O_RDONLY, None),
-                ("..", os.O_RDONLY, None),
-                ("../..", os.O_RDONLY, None),
-                (".", os.O_RDONLY, None),
-                ("/..", os.O_RDONLY, None),
-                ("a/..", os.O_RDONLY, None),
-                ("/a/..", os.O_RDONLY, None),
-                ("a/../..", os.O_RDONLY, None),
-                ("/a/../..", os.O_RDONLY, None),
-                ("a/../../..", os.O_RDONLY, None),
-                ("/a/../../..", os.O_RDONLY, None),
-                ("a/e/../..", os.O_RDONLY, None),
-                ("a/e/../../..", os.O_RDONLY, None),
-                ("a", os.O_RDONLY, "a"),
-                ("./a", os.O_RDONLY, "a"),
-                ("a/.", os.O_RDONLY, "a"),
-                ("a/e/..", os.O_RDONLY, "a"),
-                ("a/e", os.O_RDONLY, "a/e"),
-                ("a/e/../e", os.O_RDONLY, "a/e"),
-                ("b", os.O_RDONLY, "b"),
-                ("c", os.O_RDONLY, "b"),
-                ("d", os.O_RDONLY, "b"),
-                ("f", os.O_RDONLY, "a/e"),
-                ("f/..", os.O_RDONLY, "a"),
-                (b"f/..", os.O_RDONLY, "a"),
-                ("f/..", os.O_RDONLY | os.O_NOFOLLOW, "a"),
-                ("a/e/g", os.O_RDONLY, "b"),
-                ("a/./e/g", os.O_RDONLY, "b"),
-                ("a/e/h", os.O_RDONLY, "b"),
-                ("a/e/i/e", os.O_RDONLY, "a/e"),
-                ("a/e/j/..", os.O_RDONLY, "a/e"),
-                ("b", os.O_WRONLY, "b"),
-                ("b", os.O_RDWR, "b"),
-                ("c", os.O_WRONLY, "b"),
-                ("c", os.O_RDWR, "b"),
-                ("a/e/g", os.O_WRONLY, "b"),
-                ("a/e/g", os.O_RDWR, "b"),
-                ("a/e/h", os.O_WRONLY, "b"),
-                ("a/e/h", os.O_RDWR, "b"),
-            ]
-
-            if sys.platform.startswith("linux"):
-                # pylint: disable=no-member
-                try_paths.extend(
-                    [
-                        ("a", os.O_PATH, "a"),
-                        ("a", os.O_PATH | os.O_NOFOLLOW, "a"),
-                        ("f", os.O_PATH, "a/e"),
-                        ("f", os.O_PATH | os.O_NOFOLLOW, "f"),
-                    ]
-                )
-
-            for (path, flags, stat_fname) in try_paths:
-                expect_stat = (
-                    tmp_stat
-                    if stat_fname is None
-                    else os.stat(stat_fname, dir_fd=tmp_dfd, follow_symlinks=False)
-                )
-
-                with open_beneath_managed(
-                    path,
-                    flags,
-                    dir_fd=tmp_dfd,
-                    remember_parents=remember_parents,
-                    audit_func=audit_func,
-                ) as fd:
-                    assert os.path.samestat(os.stat(fd), expect_stat)
-
-                    fd_flags = fcntl.fcntl(fd, fcntl.F_GETFL)
-
-                    if sys.platform.startswith("linux"):
-                        # 0o100000 is O_LARGEFILE; it may be added by the libc
-                        fd_flags &= ~0o100000
-
-                    # Ignore O_NOFOLLOW on either side; it may be added if not present
-                    assert fd_flags & ~os.O_NOFOLLOW == flags & ~os.O_NOFOLLOW
-
-            for (path, flags, kwargs, eno) in [
-                ("NOEXIST", os.O_RDONLY, {"no_symlinks": True}, errno.ENOENT),
-                ("a/NOEXIST", os.O_RDONLY, {"no_symlinks": True}, errno.ENOENT),
-                ("b/", os.O_RDONLY, {"no_symlinks": True}, errno.ENOTDIR),
-                ("b/", os.O_RDONLY, {"no_symlinks": False}, errno.ENOTDIR),
-                ("b/a", os.O_RDONLY, {"no_symlinks": True}, errno.ENOTDIR),
-                ("d", os.O_RDONLY, {"no_symlinks": True}, errno.ELOOP),
-                ("d", os.O_RDONLY | os.O_NOFOLLOW, {"no_symlinks": False}, errno.ELOOP),
-                ("f", os.O_RDONLY | os.O_NOFOLLOW, {"no_symlinks": False}, errno.ELOOP),
-                ("f", os.O_RDONLY, {"no_symlinks": True}, errno.ELOOP),
-                ("f/..", os.O_RDONLY, {"no_symlinks": True}, errno.ELOOP),
-                ("recur", os.O_RDONLY, {"no_symlinks": False}, errno.ELOOP),
-                ("a/../recur", os.O_RDONLY, {"no_symlinks": False}, errno.ELOOP),
-                ("recur/a", os.O_RDONLY, {"no_symlinks": False}, errno.ELOOP),
-                ("/", os.O_WRONLY, {"no_symlinks": False}, errno.EISDIR),
-                (".", os.O_WRONLY, {"no_symlinks": False}, errno.EISDIR),
-                ("..", os.O_WRONLY, {"no_symlinks": False}, errno.EISDIR),
-                ("a/.", os.O_WRONLY, {"no_symlinks": False}, errno.EISDIR),
-                ("a/..", os.O_WRONLY, {"no_symlinks": False}, errno.EISDIR),
-                ("a", os.O_WRONLY, {"no_symlinks": False}, errno.EISDIR),
-                ("a/", os.O_WRONLY, {"no_symlinks": False}, errno.EISDIR),
-                ("a", os.O_DIRECTORY | os.O_WRONLY, {"no_symlinks": False}, errno.EISDIR),
-                ("a/", os.O_DIRECTORY | os.O_WRONLY, {"no_symlinks": False}, errno.EISDIR),
-                ("a/e/g/", os.O_RDONLY, {"no_symlinks": False}, errno.ENOTDIR),
-                ("a/e/h/", os.O_RDONLY, {"no_symlinks": False}, errno.ENOTDIR),
-                ("a/e/bad", os.O_RDONLY, {"no_symlinks": False}, errno.ENOTDIR),
-                ("a/e/bad/", os.O_RDONLY, {"no_symlinks": False}, errno.ENOTDIR),
-            ]:
-                with pytest.raises(
-                    OSError, match="^" + re.escape("[Errno {}] {}".format(eno, os.strerror(eno)))
-                ):
-                    nixutil.open_beneath(
-                        path,
-                        flags,
-                        dir_fd=tmp_dfd,
-                        remember_parents=remember_parents,
-                        audit_func=audit_func,
-                        **cast(Dict[str, Any], kwargs)
-                    )
+            with open_beneath_managed(
+                tmp_path,
+                os.O_RDONLY,
+                dir_fd=root_dfd,
+                remember_parents=remember_parents,
+                audit_func=audit_func,
+            ) as fd:
+                st = os.fstat(fd)
+                assert (st.st_ino, st.st_dev) == expect_keys[None]
+
+            with open_beneath_managed(
+                str(tmp_path) + "/.." * (str(tmp_path).count("/") + 2),
+                os.O_RDONLY,
+                dir_fd=root_dfd,
+                remember_parents=remember_parents,
+                audit_func=audit_func,
+            ) as fd:
+                st = os.fstat(fd)
+                assert (st.st_ino, st.st_dev) == root_key
+
+
+_REMEMBER_PARENTS_AUDIT_FUNCS = list(
+    itertools.product([False, True], [None, lambda desc, fd, name: None])
+)
+
+# Matches the start of the message for an OSError with the given errno
+_ERRNO_PATTERNS = {
+    eno: re.compile("^" + re.escape("[Errno {}] {}".format(eno, os.strerror(eno))))
+    for eno in (errno.ENOENT, errno.ENOTDIR, errno.ELOOP, errno.EISDIR, errno.EXDEV)
+}
+
+_OPEN_BENEATH_PATHS = [
+    ("/", os.O_RDONLY, None),
+    ("..", os.O_RDONLY, None),
+    ("../..", os.O_RDONLY, None),
+    (".", os.O_RDONLY, None),
+    ("/..", os.O_RDONLY, None),
+    ("a/..", os.O_RDONLY, None),
+    ("/a/..", os.O_RDONLY, None),
+    ("a/../..", os.O_RDONLY, None),
+    ("/a/../..", os.O_RDONLY, None),
+    ("a/../../..", os.O_RDONLY, None),
+    ("/a/../../..", os.O_RDONLY, None),
+    ("a/e/../..", os.O_RDONLY, None),
+    ("a/e/../../..", os.O_RDONLY, None),
+    ("a", os.O_RDONLY, "a"),
+    ("./a", os.O_RDONLY, "a"),
+    ("a/.", os.O_RDONLY, "a"),
+    ("a/e/..", os.O_RDONLY, "a"),
+    ("a/e", os.O_RDONLY, "a/e"),
+    ("a/e/../e", os.O_RDONLY, "a/e"),
+    ("b", os.O_RDONLY, "b"),
+    ("c", os.O_RDONLY, "b"),
+    ("d", os.O_RDONLY, "b"),
+    ("f", os.O_RDONLY, "a/e"),
+    ("f/..", os.O_RDONLY, "a"),
+    ("f/..", os.O_RDONLY | os.O_NOFOLLOW, "a"),
+    ("a/e/g", os.O_RDONLY, "b"),
+    ("a/./e/g", os.O_RDONLY, "b"),
+    ("a/e/h", os.O_RDONLY, "b"),
+    ("a/e/i/e", os.O_RDONLY, "a/e"),
+    ("a/e/j/..", os.O_RDONLY, "a/e"),
+    ("b", os.O_WRONLY, "b"),
+    ("b", os.O_RDWR, "b"),
+    ("c", os.O_WRONLY, "b"),
+    ("c", os.O_RDWR, "b"),
+    ("a/e/g", os.O_WRONLY, "b"),
+    ("a/e/g", os.O_RDWR, "b"),
+    ("a/e/h", os.O_WRONLY, "b"),
+    ("a/e/h", os.O_RDWR, "b"),
+]
+
+if sys.platform.startswith("linux"):
+    # pylint: disable=no-member
+    _OPEN_BENEATH_PATHS.extend(
+        [
+            ("a", os.O_PATH, "a"),
+            ("a", os.O_PATH | os.O_NOFOLLOW, "a"),
+            ("f", os.O_PATH, "a/e"),
+            ("f", os.O_PATH | os.O_NOFOLLOW, "f"),
+        ]
+    )
+
+
+@pytest.mark.parametrize("remember_parents,audit_func", _REMEMBER_PARENTS_AUDIT_FUNCS)
+@pytest.mark.parametrize("path,flags,stat_fname", _OPEN_BENEATH_PATHS)
+@pytest.mark.parametrize("as_bytes", [False, True], ids=["str", "bytes"])
+def test_open_beneath(
+    beneath_tree: _BeneathTree,
+    as_bytes: bool,
+    path: str,
+    flags: int,
+    stat_fname: Optional[str],
+    remember_parents: bool,
+    audit_func: Optional[Callable[[str, int, Any], None]],
+) -> None:
+    _, tmp_dfd, expect_keys = beneath_tree
+
+    with open_beneath_managed(
+        os.fsencode(path) if as_bytes else path,
+        flags,
+        dir_fd=tmp_dfd,
+        remember_parents=remember_parents,
+        audit_func=audit_func,
+    ) as fd:
+        st = os.fstat(fd)
+        assert (st.st_ino, st.st_dev) == expect_keys[stat_fname]
+
+        fd_flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+
+        if sys.platform.startswith("linux"):
+            # 0o100000 is O_LARGEFILE; it may be added by the libc
+            fd_flags &= ~0o100000
+
+        # Ignore O_NOFOLLOW on either side; it may be added if not present
+        assert fd_flags & ~os.O_NOFOLLOW == flags & ~os.O_NOFOLLOW
+
+
+@pytest.mark.parametrize("remember_parents,audit_func", _REMEMBER_PARENTS_AUDIT_FUNCS)
+@pytest.mark.parametrize(
+    "path,flags,no_symlinks,eno",
+    [
+        ("NOEXIST", os.O_RDONLY, True, errno.ENOENT),
+        ("a/NOEXIST", os.O_RDONLY, True, errno.ENOENT),
+        ("b/", os.O_RDONLY, True, errno.ENOTDIR),
+        ("b/", os.O_RDONLY, False, errno.ENOTDIR),
+        ("b/a", os.O_RDONLY, True, errno.ENOTDIR),
+        ("d", os.O_RDONLY, True, errno.ELOOP),
+        ("d", os.O_RDONLY | os.O_NOFOLLOW, False, errno.ELOOP),
+        ("f", os.O_RDONLY | os.O_NOFOLLOW, False, errno.ELOOP),
+        ("f", os.O_RDONLY, True, errno.ELOOP),
+        ("f/..", os.O_RDONLY, True, errno.ELOOP),
+        ("recur", os.O_RDONLY, False, errno.ELOOP),
+        ("a/../recur", os.O_RDONLY, False, errno.ELOOP),
+        ("recur/a", os.O_RDONLY, False, errno.ELOOP),
+        ("/", os.O_WRONLY, False, errno.EISDIR),
+        (".", os.O_WRONLY, False, errno.EISDIR),
+        ("..", os.O_WRONLY, False, errno.EISDIR),
+        ("a/.", os.O_WRONLY, False, errno.EISDIR),
+        ("a/..", os.O_WRONLY, False, errno.EISDIR),
+        ("a", os.O_WRONLY, False, errno.EISDIR),
+        ("a/", os.O_WRONLY, False, errno.EISDIR),
+        ("a", os.O_DIRECTORY | os.O_WRONLY, False, errno.EISDIR),
+        ("a/", os.O_DIRECTORY | os.O_WRONLY, False, errno.EISDIR),
+        ("a/e/g/", os.O_RDONLY, False, errno.ENOTDIR),
+        ("a/e/h/", os.O_RDONLY, False, errno.ENOTDIR),
+        ("a/e/bad", os.O_RDONLY, False, errno.ENOTDIR),
+        ("a/e/bad/", os.O_RDONLY, False, errno.ENOTDIR),
+    ],
+)
+def test_open_beneath_error(
+    beneath_tree: _BeneathTree,
+    path: str,
+    flags: int,
+    no_symlinks: bool,
+    eno: int,
+    remember_parents: bool,
+    audit_func: Optional[Callable[[str, int, Any], None]],
+) -> None:
+    _, tmp_dfd, _ = beneath_tree
+
+    with pytest.raises(OSError, match=_ERRNO_PATTERNS[eno]):
+        nixutil.open_beneath(
+            path,
+            flags,
+            dir_fd=tmp_dfd,
+            no_symlinks=no_symlinks,
+            remember_parents=remember_parents,
+            audit_func=audit_func,
+        )
+
+
+_SINGLE_COMPONENT_PATHS = [
+    # Opened directly
+    ("a", os.O_RDONLY, "a"),
+    ("b", os.O_RDONLY, "b"),
+    ("b", os.O_RDWR, "b"),
+    # Symlinks fall through to full resolution
+    ("c", os.O_RDONLY, "b"),
+    ("f", os.O_RDONLY, "a/e"),
+]
+
+if sys.platform.startswith("linux"):
+    # pylint: disable=no-member
+    _SINGLE_COMPONENT_PATHS.extend(
+        [
+            # O_PATH | O_NOFOLLOW opens the symlink itself, so the symlink has to be caught
+            ("f", os.O_PATH, "a/e"),
+            ("f", os.O_PATH | os.O_NOFOLLOW, "f"),
+        ]
+    )
+
+
+@pytest.mark.parametrize("path,flags,stat_fname", _SINGLE_COMPONENT_PATHS)
+def test_open_beneath_single_component(
+    beneath_tree: _BeneathTree,
+    monkeypatch: pytest.MonkeyPatch,
+    path: str,
+    flags: int,
+    stat_fname: str,
+) -> None:
+    # The fast path for single components is only used without audit_func, and only if openat2()
+    # isn't available (or fails), so disable openat2() to make sure it gets tested.
+    monkeypatch.setattr(nixutil.beneath, "_try_open_beneath", None)
+
+    _, tmp_dfd, expect_keys = beneath_tree
+
+    with open_beneath_managed(path, flags, dir_fd=tmp_dfd) as fd:
+        st = os.fstat(fd)
+        assert (st.st_ino, st.st_dev) == expect_keys[stat_fname]
+
+
+@pytest.mark.parametrize(
+    "path,flags,no_symlinks,eno",
+    [
+        ("", os.O_RDONLY, False, errno.ENOENT),
+        ("NOEXIST", os.O_RDONLY, False, errno.ENOENT),
+        # Not a symlink, so this is raised directly
+        ("b", os.O_RDONLY | os.O_DIRECTORY, False, errno.ENOTDIR),
+        ("a", os.O_WRONLY, False, errno.EISDIR),
+        # Symlinks
+        ("c", os.O_RDONLY, True, errno.ELOOP),
+        ("c", os.O_RDONLY | os.O_NOFOLLOW, False, errno.ELOOP),
+        ("recur", os.O_RDONLY, False, errno.ELOOP),
+    ],
+)
+def test_open_beneath_single_component_error(
+    beneath_tree: _BeneathTree,
+    monkeypatch: pytest.MonkeyPatch,
+    path: str,
+    flags: int,
+    no_symlinks: bool,
+    eno: int,
+) -> None:
+    monkeypatch.setattr(nixutil.beneath, "_try_open_beneath", None)
+
+    _, tmp_dfd, _ = beneath_tree
+
+    with pytest.raises(OSError, match=_ERRNO_PATTERNS[eno]):
+        nixutil.open_beneath(path, flags, dir_fd=tmp_dfd, no_symlinks=no_symlinks)
 
 
 def test_open_beneath_escape(tmp_path: pathlib.Path) -> None:
@@ -244,12 +393,13 @@ def test_open_beneath_escape(tmp_path: pathlib.Path) -> None:
 
     with managed_open(tmp_path / "a", os.O_RDONLY) as a_dfd:
         for path in ["b/..", "b/../..", "b/../b", "b/../../a"]:
-            with pytest.raises(OSError, match="^" + re.escape("[Errno {}]".format(errno.EXDEV))):
+            with pytest.raises(OSError, match=_ERRNO_PATTERNS[errno.EXDEV]):
                 nixutil.open_beneath(path, os.O_RDONLY, dir_fd=a_dfd, audit_func=audit_func)
 
             os.rename(tmp_path / "b", tmp_path / "a/b")
 
 
+@pytest.mark.skipif(os.geteuid() == 0, reason="Cannot run permissions-related tests as root")
 def test_open_beneath_execute(tmp_path: pathlib.Path) -> None:
     if nixutil.beneath.DIR_OPEN_FLAGS == os.O_DIRECTORY | os.O_RDONLY:
         # No extra flags like O_PATH or O_SEARCH available on the current platform
@@ -257,9 +407,6 @@ def test_open_beneath_execute(tmp_path: pathlib.Path) -> None:
             "Unable to look in subdirectories without 'read' permission on the current platform"
         )
 
-    if os.geteuid() == 0:
-        pytest.skip("Unable to run 'execute' test when running as root")
-
     os.mkdir(tmp_path / "a")
 
     with open(tmp_path / "a/b", "w"):
@@ -267,6 +414,10 @@ def test_open_beneath_execute(tmp_path: pathlib.Path) -> None:
 
     os.symlink("b", tmp_path / "a/c")
 
+    # Both "a/b" and "a/c" should resolve to this
+    b_stat = os.stat(tmp_path / "a/b")
+    b_key = (b_stat.st_ino, b_stat.st_dev)
+
     try:
         # 0o100 is "--x------"; i.e. execute permission but not read permission.
         # That allows us to look at files within the directory, but not list the directory (or open
@@ -278,8 +429,6 @@ def test_open_beneath_execute(tmp_path: pathlib.Path) -> None:
                 [False, True], [None, lambda desc, fd, name: None]
             ):
                 for path in ["a/b", "a/c"]:
-                    expect_stat = os.stat(path, dir_fd=tmp_dfd)
-
                     with open_beneath_managed(
                         path,
                         os.O_RDONLY,
@@ -287,7 +436,8 @@ def test_open_beneath_execute(tmp_path: pathlib.Path) -> None:
                         audit_func=audit_func,
                         remember_parents=remember_parents,
                     ) as fd:
-                        assert os.path.samestat(os.fstat(fd), expect_stat)
+                        st = os.fstat(fd)
+                        assert (st.st_ino, st.st_dev) == b_key
 
                 with pytest.raises(PermissionError):
                     nixutil.open_beneath(
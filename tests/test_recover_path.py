@@ -1,7 +1,11 @@
+# pylint: disable=redefined-outer-name
 import errno
+import json
 import os
 import pathlib
+import re
 import socket
+from typing import List, Union, cast
 
 import pytest
 
@@ -9,38 +13,46 @@ import nixutil
 
 from .util import managed_open
 
+_SC_OPEN_MAX = os.sysconf("SC_OPEN_MAX")
 
-def test_recover_fd_path_dir(tmp_path: pathlib.Path) -> None:
-    with managed_open(tmp_path, os.O_RDONLY) as fd:
-        assert nixutil.recover_fd_path(fd) == os.path.realpath(tmp_path)
+_NOTSUP_PATTERN = re.compile(r"[nN]ot supported")
+_BADF_PATTERN = re.compile(r"[bB]ad file descriptor")
+
+
+@pytest.fixture
+def tmp_real(tmp_path: pathlib.Path) -> str:
+    # tmp_path may itself be reached through a symlink; recover_fd_path() returns the real path
+    return os.path.realpath(tmp_path)
+
+
+def _assert_notsup(fd: int) -> None:
+    with pytest.raises(OSError, match=_NOTSUP_PATTERN):
+        nixutil.recover_fd_path(fd)
 
+
+def test_recover_fd_path_dir(tmp_path: pathlib.Path, tmp_real: str) -> None:
     with managed_open(tmp_path, os.O_RDONLY) as fd:
-        assert nixutil.recover_fd_path(fd) == os.path.realpath(tmp_path)
+        assert nixutil.recover_fd_path(fd) == tmp_real
 
     with managed_open("/", os.O_RDONLY) as fd:
         assert nixutil.recover_fd_path(fd) == "/"
 
 
-def test_recover_fd_path_link(tmp_path: pathlib.Path) -> None:
+def test_recover_fd_path_link_and_move(tmp_path: pathlib.Path, tmp_real: str) -> None:
     os.mkdir(tmp_path / "dir")
     os.symlink("dir", tmp_path / "link")
 
     with managed_open(tmp_path / "link", os.O_RDONLY) as fd:
         # The path that's returned is the path *after* resolving symlinks
-        assert nixutil.recover_fd_path(fd) == os.path.realpath(tmp_path / "dir")
-
+        assert nixutil.recover_fd_path(fd) == os.path.join(tmp_real, "dir")
 
-def test_recover_fd_path_moved(tmp_path: pathlib.Path) -> None:
-    os.mkdir(tmp_path / "dir")
-
-    with managed_open(tmp_path / "dir", os.O_RDONLY) as fd:
         os.rename(tmp_path / "dir", tmp_path / "dir2")
 
-        # The path that's returned is the *new* path
-        assert nixutil.recover_fd_path(fd) == os.path.realpath(tmp_path / "dir2")
+        # After it's moved, the path that's returned is the *new* path
+        assert nixutil.recover_fd_path(fd) == os.path.join(tmp_real, "dir2")
 
 
-def test_recover_fd_path_dir_deleted(tmp_path: pathlib.Path) -> None:
+def test_recover_fd_path_dir_deleted(tmp_path: pathlib.Path, tmp_real: str) -> None:
     os.mkdir(tmp_path / "a")
 
     with managed_open(tmp_path / "a", os.O_RDONLY) as fd:
@@ -48,34 +60,38 @@ def test_recover_fd_path_dir_deleted(tmp_path: pathlib.Path) -> None:
 
         # Either it returns the correct path or raises a FileNotFoundError.
         try:
-            assert nixutil.recover_fd_path(fd) == os.path.join(os.path.realpath(tmp_path), "a")
+            assert nixutil.recover_fd_path(fd) == os.path.join(tmp_real, "a")
         except FileNotFoundError:
             pass
 
 
-def test_recover_fd_path_dir_fallback(tmp_path: pathlib.Path) -> None:
-    old_func = getattr(nixutil.plat_util, "try_recover_fd_path", None)
-    if old_func is not None:
-        del nixutil.plat_util.try_recover_fd_path
+def test_recover_fd_path_dir_fallback(
+    tmp_path: pathlib.Path, tmp_real: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(nixutil.recover_path, "_try_recover_fd_path", None)
 
-    try:
-        with managed_open(tmp_path, os.O_RDONLY) as fd:
-            assert nixutil.recover_fd_path(fd) == os.path.realpath(tmp_path)
+    with managed_open(tmp_path, os.O_RDONLY) as fd:
+        assert nixutil.recover_fd_path(fd) == tmp_real
 
-        # Without OS-specific help, ENOTSUP is raised for regular files
-        with open(tmp_path / "a", "w") as file:
-            with pytest.raises(OSError, match=r"[nN]ot supported"):
-                nixutil.recover_fd_path(file.fileno())
+    # Without OS-specific help, ENOTSUP is raised for regular files
+    with managed_open(tmp_path / "a", os.O_WRONLY | os.O_CREAT) as file_fd:
+        _assert_notsup(file_fd)
 
-    finally:
-        if old_func is not None:
-            nixutil.plat_util.try_recover_fd_path = old_func
 
+@pytest.mark.skipif(not os.path.ismount("/proc"), reason="/proc is not a mountpoint")
+def test_recover_fd_path_mountpoint_fallback(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(nixutil.recover_path, "_try_recover_fd_path", None)
+
+    # The directory entry for a mountpoint has the inode number of the directory underneath it, so
+    # this has to be found by stat()ing the other directories in "/"
+    with managed_open("/proc", os.O_RDONLY) as fd:
+        assert nixutil.recover_fd_path(fd) == "/proc"
 
-def test_recover_fd_path_file(tmp_path: pathlib.Path) -> None:
-    with open(tmp_path / "a", "w") as file:
+
+def test_recover_fd_path_file(tmp_path: pathlib.Path, tmp_real: str) -> None:
+    with managed_open(tmp_path / "a", os.O_WRONLY | os.O_CREAT) as file_fd:
         try:
-            assert nixutil.recover_fd_path(file.fileno()) == os.path.realpath(tmp_path / "a")
+            assert nixutil.recover_fd_path(file_fd) == os.path.join(tmp_real, "a")
         except OSError as ex:
             if ex.errno == errno.ENOTSUP:
                 pytest.skip("Recovering paths of regular files not supported")
@@ -83,86 +99,130 @@ def test_recover_fd_path_file(tmp_path: pathlib.Path) -> None:
                 raise
 
 
-def test_recover_fd_path_bad_file() -> None:
+@pytest.mark.parametrize("fd", range(-10, 0))
+def test_recover_fd_path_negative_fd(fd: int) -> None:
     # Negative file descriptors always raise an error
-    for i in range(-10, 0):
-        with pytest.raises(OSError, match=r"[bB]ad file descriptor"):
-            nixutil.recover_fd_path(i)
+    with pytest.raises(OSError, match=_BADF_PATTERN):
+        nixutil.recover_fd_path(fd)
+
 
+def test_recover_fd_path_open_max() -> None:
     # This is larger than any file descriptor that we should be allowed to open
-    with pytest.raises(OSError, match=r"[bB]ad file descriptor"):
-        nixutil.recover_fd_path(os.sysconf("SC_OPEN_MAX"))
+    with pytest.raises(OSError, match=_BADF_PATTERN):
+        nixutil.recover_fd_path(_SC_OPEN_MAX)
 
-    # Sockets and pipes aren't allowed
 
+def test_recover_fd_path_socket() -> None:
+    # Sockets aren't allowed
     with socket.socket() as sock:
-        with pytest.raises(OSError, match=r"[nN]ot supported"):
-            nixutil.recover_fd_path(sock.fileno())
+        _assert_notsup(sock.fileno())
 
+
+def test_recover_fd_path_pipe() -> None:
+    # Pipes aren't allowed
     r_fd, w_fd = os.pipe()
     try:
-        with pytest.raises(OSError, match=r"[nN]ot supported"):
-            nixutil.recover_fd_path(r_fd)
-        with pytest.raises(OSError, match=r"[nN]ot supported"):
-            nixutil.recover_fd_path(w_fd)
+        _assert_notsup(r_fd)
+        _assert_notsup(w_fd)
     finally:
         os.close(r_fd)
         os.close(w_fd)
 
 
 @pytest.mark.skipif(os.geteuid() == 0, reason="Cannot run permissions-related tests as root")
-def test_recover_fd_path_execute(tmp_path: pathlib.Path) -> None:
+def test_recover_fd_path_execute(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
     os.mkdir(tmp_path / "a")
     os.mkdir(tmp_path / "a/b")
 
-    old_func = getattr(nixutil.plat_util, "try_recover_fd_path", None)
-    if old_func is not None:
-        del nixutil.plat_util.try_recover_fd_path
+    monkeypatch.setattr(nixutil.recover_path, "_try_recover_fd_path", None)
 
-    try:
-        with managed_open(tmp_path / "a/b", os.O_RDONLY) as b_dfd:
-            try:
-                # 0o100 is "--x------"; i.e. execute permission but not read permission.
-                # That allows us to access files in the directory, but not list it.
-                os.chmod(tmp_path / "a", 0o100)
+    with managed_open(tmp_path / "a/b", os.O_RDONLY) as b_dfd:
+        try:
+            # 0o100 is "--x------"; i.e. execute permission but not read permission.
+            # That allows us to access files in the directory, but not list it.
+            os.chmod(tmp_path / "a", 0o100)
 
-                # Fails with EACCES when trying to open the directory
-                with pytest.raises(PermissionError):
-                    nixutil.recover_fd_path(b_dfd)
+            # Fails with EACCES when trying to open the directory
+            with pytest.raises(PermissionError):
+                nixutil.recover_fd_path(b_dfd)
 
-            finally:
-                # chmod() it back so pytest can remove it
-                os.chmod(tmp_path / "a", 0o755)
-
-    finally:
-        if old_func is not None:
-            nixutil.plat_util.try_recover_fd_path = old_func
+        finally:
+            # chmod() it back so pytest can remove it
+            os.chmod(tmp_path / "a", 0o755)
 
 
 @pytest.mark.skipif(os.geteuid() == 0, reason="Cannot run permissions-related tests as root")
-def test_recover_fd_path_no_execute(tmp_path: pathlib.Path) -> None:
+def test_recover_fd_path_no_execute(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
     os.mkdir(tmp_path / "a")
     os.mkdir(tmp_path / "a/b")
 
-    old_func = getattr(nixutil.plat_util, "try_recover_fd_path", None)
-    if old_func is not None:
-        del nixutil.plat_util.try_recover_fd_path
+    monkeypatch.setattr(nixutil.recover_path, "_try_recover_fd_path", None)
 
-    try:
-        with managed_open(tmp_path / "a/b", os.O_RDONLY) as b_dfd:
-            try:
-                # 0o400 is "r--------"; i.e. read permission but not execute permission.
-                # That allows us to list the directory, but not access files in it.
-                os.chmod(tmp_path / "a", 0o400)
+    with managed_open(tmp_path / "a/b", os.O_RDONLY) as b_dfd:
+        try:
+            # 0o400 is "r--------"; i.e. read permission but not execute permission.
+            # That allows us to list the directory, but not access files in it.
+            os.chmod(tmp_path / "a", 0o400)
 
-                # Fails with ENOENT after failing to stat() any of the entries and reaching the end
-                with pytest.raises(FileNotFoundError):
-                    nixutil.recover_fd_path(b_dfd)
+            # Fails with ENOENT after failing to stat() any of the entries and reaching the end
+            with pytest.raises(FileNotFoundError):
+                nixutil.recover_fd_path(b_dfd)
 
-            finally:
-                # chmod() it back so pytest can remove it
-                os.chmod(tmp_path / "a", 0o755)
+        finally:
+            # chmod() it back so pytest can remove it
+            os.chmod(tmp_path / "a", 0o755)
 
-    finally:
-        if old_func is not None:
-            nixutil.plat_util.try_recover_fd_path = old_func
+
+def _recover_in_chroot(root: pathlib.Path, fds: List[int]) -> List[Union[str, int, None]]:
+    # chroot() can't be undone, so do it in a child process. Returns the path recovered for each
+    # file descriptor, or the errno if recover_fd_path() failed.
+    r_fd, w_fd = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(r_fd)
+
+            os.chroot(root)
+            os.chdir("/")
+
+            results: List[Union[str, int, None]] = []
+            for fd in fds:
+                try:
+                    results.append(nixutil.recover_fd_path(fd))
+                except OSError as ex:
+                    results.append(ex.errno)
+
+            os.write(w_fd, json.dumps(results).encode())
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+
+    os.close(w_fd)
+    with open(r_fd, "rb") as file:
+        data = file.read()
+    os.waitpid(pid, 0)
+
+    return cast(List[Union[str, int, None]], json.loads(data))
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="chroot() requires root")
+def test_recover_fd_path_chroot(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(nixutil.recover_path, "_try_recover_fd_path", None)
+
+    os.mkdir(tmp_path / "jail")
+    os.mkdir(tmp_path / "outside")
+
+    with managed_open("/", os.O_RDONLY) as root_fd, managed_open(
+        tmp_path / "outside", os.O_RDONLY
+    ) as outside_fd:
+        # Look them up once before chroot()ing, in case anything is remembered from the first call
+        assert nixutil.recover_fd_path(root_fd) == "/"
+        assert nixutil.recover_fd_path(outside_fd) == os.path.realpath(tmp_path / "outside")
+
+        # Once we've chroot()ed into "jail", both are outside the new root
+        assert _recover_in_chroot(tmp_path / "jail", [root_fd, outside_fd]) == [
+            errno.ENOENT,
+            errno.ENOENT,
+        ]
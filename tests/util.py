@@ -1,15 +1,20 @@
-import contextlib
 import os
-from typing import Generator, Union
+from typing import Any, Union
 
 
-@contextlib.contextmanager
-def managed_open(
-    path: Union[str, bytes, "os.PathLike[str]", "os.PathLike[bytes]"], flags: int
-) -> Generator[int, None, None]:
-    fd = os.open(path, flags)
+class managed_open:  # pylint: disable=invalid-name
+    __slots__ = ("_path", "_flags", "_fd")
 
-    try:
-        yield fd
-    finally:
-        os.close(fd)
+    def __init__(
+        self, path: Union[str, bytes, "os.PathLike[str]", "os.PathLike[bytes]"], flags: int
+    ) -> None:
+        self._path = path
+        self._flags = flags
+        self._fd = -1
+
+    def __enter__(self) -> int:
+        self._fd = os.open(self._path, self._flags)
+        return self._fd
+
+    def __exit__(self, *exc: Any) -> None:
+        os.close(self._fd)